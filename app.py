@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 from streamlit.components.v1 import html as st_html
 
 from places_core import (
+    CITY_KEYS,
     CITY_PRESETS,
     places_search_text,
     make_items_from_places,
@@ -13,6 +16,22 @@ from places_core import (
 
 st.set_page_config(page_title="قائمة المطاعم", page_icon="🍽️")
 
+CITY_OPTIONS = ["—", *CITY_KEYS]
+
+# pool خلفي للنشر إلى ووردبريس حتى لا تتجمد الواجهة طوال مهلة الطلب (60 ثانية)
+@st.cache_resource(show_spinner=False)
+def _bg_pool():
+    return ThreadPoolExecutor(max_workers=2)
+
+# كاش على مستوى Streamlit: إعادة تشغيل الصفحة بنفس المدخلات لا تستهلك API.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_search(api_key, query, city_key, n):
+    return places_search_text(api_key, query, city_key, n)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_items(api_key, places, min_reviews, region_code):
+    return make_items_from_places(api_key, places, min_reviews, region_code=region_code)
+
 st.title("🍽️ جلب مطاعم من Google Places ونشرها كمسودة ووردبريس")
 
 # --------------------------
@@ -31,7 +50,7 @@ with st.sidebar:
 # --------------------------
 st.subheader("🔎 استعلام البحث")
 query_text  = st.text_input("اكتب ما تريد البحث عنه", placeholder="مثال: مطاعم بيتزا في الرياض")
-city_key    = st.selectbox("المدينة (اختياري)", options=["—"]+list(CITY_PRESETS.keys()), index=0)
+city_key    = st.selectbox("المدينة (اختياري)", options=CITY_OPTIONS, index=0)
 max_results = st.number_input("أقصى عدد نتائج", min_value=5, max_value=20, value=15, step=1)
 min_reviews = st.slider("أقل عدد مراجعات", 0, 2000, 200, 50)
 
@@ -48,14 +67,16 @@ if st.button("جلب النتائج"):
     else:
         try:
             effective_city = city_key if city_key!="—" else "riyadh"
-            places = places_search_text(google_api_key, final_query, effective_city, int(max_results))
+            places = _cached_search(google_api_key, final_query, effective_city, int(max_results))
             region_code = CITY_PRESETS.get(effective_city,{}).get("regionCode")
-            items = make_items_from_places(google_api_key, places, int(min_reviews), region_code=region_code)
+            items = _cached_items(google_api_key, places, int(min_reviews), region_code=region_code)
 
             st.session_state["items"] = items
             st.success(f"✅ تم الجلب. عدد النتائج بعد الفلترة: {len(items)}")
 
             if items:
+                import pandas as pd  # مؤجل: يُحمّل فقط عند عرض النتائج لا مع كل إقلاع بارد
+
                 df = pd.DataFrame([{
                     "الاسم": it["name"],
                     "العنوان": it["address"],
@@ -85,11 +106,24 @@ if st.button("انشر كمسودة"):
     elif not wp_base_url or not wp_user or not wp_app_pass:
         st.error("⚠️ أدخل إعدادات ووردبريس كاملة (URL + Username + App Password).")
     else:
+        # النشر في الخلفية: الواجهة تستجيب فورًا ونتابع الحالة مع كل rerun
+        html_content = build_post_html(items, draft_title)
+        st.session_state["wp_future"] = _bg_pool().submit(
+            create_or_update_draft_post, wp_base_url, wp_user, wp_app_pass, draft_title, html_content
+        )
+
+wp_future = st.session_state.get("wp_future")
+if wp_future is not None:
+    if wp_future.done():
+        del st.session_state["wp_future"]
         try:
-            html_content = build_post_html(items, draft_title)
-            res = create_or_update_draft_post(wp_base_url, wp_user, wp_app_pass, draft_title, html_content)
+            res = wp_future.result()
             st.success(f"✅ تم إنشاء المسودة #{res.get('id')}")
             if res.get("link"):
                 st.markdown(f"[رابط المسودة في ووردبريس]({res['link']})")
         except Exception as e:
             st.error(f"❌ فشل النشر: {e}")
+    else:
+        st.info("⏳ جاري النشر إلى ووردبريس في الخلفية…")
+        time.sleep(0.5)
+        st.rerun()
@@ -4,11 +4,63 @@ places_core.py
 Reusable core functions for fetching Google Places (New) data and publishing to WordPress.
 """
 
+import asyncio
 import datetime
-import html
+import functools
+import importlib.util
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # اختياري: نرجع لمسار الـ threads إذا لم يكن مثبتًا
+    httpx = None
+
+try:
+    import orjson
+except ImportError:  # اختياري: نرجع لـ json القياسي إذا لم يكن مثبتًا
+    orjson = None
+
+def _parse_json(response):
+    """يفك JSON من جسم الاستجابة عبر orjson (C-level) إن توفر، وإلا json القياسي."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+DETAILS_MAX_WORKERS = 10
+
+# -----------------------------
+# HTTP session (keep-alive + retries)
+# -----------------------------
+# جلسة واحدة مشتركة: تعيد استخدام اتصالات TCP/TLS بدل فتح اتصال جديد لكل طلب.
+# الـ adapters في requests آمنة للاستخدام من عدة threads، فنشاركها مع الـ ThreadPoolExecutor.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+)
+_SESSION.mount("https://", _adapter)
+_SESSION.mount("http://", _adapter)
+
+# HTTPTransport لا يتحقق من وجود h2 عند الإنشاء بل عند أول طلب يتفاوض على
+# HTTP/2، فنفحص الحزمة هنا صراحةً بدل انتظار ModuleNotFoundError وقت الطلب
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+def _make_http_client():
+    """عميل HTTP/2 متزامن إن توفر httpx؛ التعدد عبر اتصال TLS واحد بدل keep-alive فقط."""
+    if httpx is None:
+        return _SESSION
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+    transport = httpx.HTTPTransport(http2=_HTTP2, retries=3, limits=limits)
+    return httpx.Client(transport=transport)
+
+_CLIENT = _make_http_client()
 
 # -----------------------------
 # City presets
@@ -22,6 +74,9 @@ CITY_PRESETS = {
     "sharjah":  {"lat": 25.3463, "lng": 55.4209, "radius": 25000, "regionCode": "AE", "ar": "الشارقة"},
 }
 
+# محسوبة مرة واحدة عند الاستيراد؛ Streamlit يعيد تشغيل app.py مع كل تفاعل
+CITY_KEYS = tuple(CITY_PRESETS)
+
 # -----------------------------
 # Helpers
 # -----------------------------
@@ -48,51 +103,46 @@ def coerce_price_level(v) -> Optional[int]:
     return mapping.get(s, None)
 
 def safe_int(v, default=0):
+    # المسار السريع: Places يرجع userRatingCount كـ int أصلًا
+    if type(v) is int: return v
     try: return int(v)
     except Exception:
         try: return int(str(v).replace(",", "").strip())
         except Exception: return default
 
 def safe_float(v, default=None):
+    if type(v) is float: return v
     try: return float(v)
     except Exception:
         try: return float(str(v).replace(",", "").strip())
         except Exception: return default
 
+# تمريرة regex واحدة لكل بدائل AM/PM بدل أربع استدعاءات replace متتالية
+_AMPM_RE = re.compile(r"AM|PM|am|pm")
+_AMPM_MAP = {"AM": "ص", "PM": "م", "am": "ص", "pm": "م"}
+
 def normalize_time_string(s: str) -> str:
     if ":" in s:
         times = s.split(":", 1)[1].strip()
     else:
         times = s.strip()
-    return times.replace("AM","ص").replace("PM","م").replace("am","ص").replace("pm","م").replace("-", "–")
+    return _AMPM_RE.sub(lambda m: _AMPM_MAP[m.group(0)], times).replace("-", "–")
+
+_THURSDAY_RE = re.compile(r"Thursday|الخميس")
 
 def extract_thursday_times(weekday_desc: List[str]) -> str:
     """Return Thursday hours only (without the word Thursday)."""
     if not weekday_desc: return "—"
     for raw in weekday_desc:
-        if "Thursday" in raw or "الخميس" in raw:
+        if _THURSDAY_RE.search(raw):
             return normalize_time_string(raw)
     return normalize_time_string(weekday_desc[0])
 
 # -----------------------------
 # HTML builders
 # -----------------------------
-def build_html_item(p: Dict) -> str:
-    name = html.escape(p.get("name", "مطعم"))
-    address = html.escape(p.get("address", "—"))
-    phone = html.escape(p.get("phone", "—"))
-    price_range = html.escape(p.get("price_range", "غير محدد"))
-    website = p.get("website", "")
-    maps_uri = p.get("maps_uri", "")
-    thursday_hours = html.escape(p.get("thursday_hours", "—"))
-    family = html.escape(p.get("family_friendly", "—"))
-    signature = html.escape(p.get("signature_dish", "")) if p.get("signature_dish") else "—"
-    crowd = html.escape(p.get("crowd_note", "—"))
-
-    website_html = f'<a href="{website}" target="_blank" rel="nofollow noopener">زيارة الموقع</a>' if website else "—"
-    maps_html = f'<a href="{maps_uri}" target="_blank" rel="nofollow noopener">فتح في خرائط Google</a>' if maps_uri else "—"
-
-    return f"""
+# القالب ثابت؛ يُجمَّع مرة واحدة عند الاستيراد وتبقى التعبئة فقط لكل بطاقة
+_CARD_TPL = """
 <div dir="rtl" style="padding:16px;margin-bottom:16px;">
   <h3 style="margin:0 0 8px 0;font-size:20px;">{name}</h3>
   <div style="line-height:1.9;">
@@ -108,22 +158,78 @@ def build_html_item(p: Dict) -> str:
   </div>
 </div>
 """
+_render_card = _CARD_TPL.format_map
+
+# نفس بدائل html.escape(quote=True) لكن عبر str.translate: تمريرة C واحدة
+# بدل الحلقة البايثونية داخل html.escape لكل حقل
+_ESC = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+def _esc(s: str) -> str:
+    return s.translate(_ESC)
+
+# الكاش مفتاحه محتوى الحقول نفسها: تغيّر التفاصيل (بعد انتهاء TTL مثلًا)
+# يرسم بطاقة جديدة، والحجم مقيد بدل dict ينمو بلا حدود
+@functools.lru_cache(maxsize=512)
+def _render_item(name, address, phone, price_range, thursday_hours,
+                 family, signature_dish, crowd, website, maps_uri) -> str:
+    name, address, phone, price_range, thursday_hours, family, crowd = map(_esc, (
+        name, address, phone, price_range, thursday_hours, family, crowd,
+    ))
+    signature = _esc(signature_dish) if signature_dish else "—"
+
+    return _render_card({
+        "name": name,
+        "address": address,
+        "phone": phone,
+        "thursday_hours": thursday_hours,
+        "family": family,
+        "price_range": price_range,
+        "signature": signature,
+        "crowd": crowd,
+        "maps_html": f'<a href="{maps_uri}" target="_blank" rel="nofollow noopener">فتح في خرائط Google</a>' if maps_uri else "—",
+        "website_html": f'<a href="{website}" target="_blank" rel="nofollow noopener">زيارة الموقع</a>' if website else "—",
+    })
+
+def build_html_item(p: Dict) -> str:
+    return _render_item(
+        p.get("name", "مطعم"),
+        p.get("address", "—"),
+        p.get("phone", "—"),
+        p.get("price_range", "غير محدد"),
+        p.get("thursday_hours", "—"),
+        p.get("family_friendly", "—"),
+        p.get("signature_dish", ""),
+        p.get("crowd_note", "—"),
+        p.get("website", ""),
+        p.get("maps_uri", ""),
+    )
+
+# تحت هذا الحد تكلفة إنشاء الـ pool أكبر من مكسب التوازي
+_PARALLEL_CARDS_THRESHOLD = 64
 
 def build_post_html(items: List[Dict], title: str) -> str:
     now = datetime.datetime.now().strftime("%Y-%m-%d")
-    cards = "\n".join(build_html_item(p) for p in items)
-    return f"""
-<div dir="rtl">
-  <p>آخر تحديث: {now}. المصدر: خرائط Google.</p>
-  {cards}
-</div>
-"""
+    # قائمة واحدة معروفة الحجم + join واحد بدل تجميع نصوص متكرر
+    parts = [f'\n<div dir="rtl">\n  <p>آخر تحديث: {now}. المصدر: خرائط Google.</p>']
+    if len(items) > _PARALLEL_CARDS_THRESHOLD:
+        with ThreadPoolExecutor() as ex:
+            parts += ex.map(build_html_item, items, chunksize=16)
+    else:
+        parts += [build_html_item(p) for p in items]
+    parts.append("</div>\n")
+    return "\n".join(parts)
 
 # -----------------------------
 # Google Places (New)
 # -----------------------------
 PLACES_SEARCH_URL = "https://places.googleapis.com/v1/places:searchText"
 PLACES_DETAILS_URL_TMPL = "https://places.googleapis.com/v1/places/{place_id}"
+# نطلب فقط ما تستهلكه make_items_from_places فعليًا: Google يحاسب ويحجّم الرد حسب الحقول
+DETAILS_FIELD_MASK = ",".join([
+    "displayName","formattedAddress","nationalPhoneNumber",
+    "websiteUri","googleMapsUri","priceLevel","rating","userRatingCount",
+    "regularOpeningHours.weekdayDescriptions","currentOpeningHours.weekdayDescriptions"
+])
 
 def places_search_text(api_key: str, query: str, city_key: str, max_results: int = 15):
     preset = CITY_PRESETS.get(city_key.lower())
@@ -141,23 +247,21 @@ def places_search_text(api_key: str, query: str, city_key: str, max_results: int
         "X-Goog-Api-Key": api_key,
         "X-Goog-FieldMask": "places.id,places.displayName,places.rating,places.userRatingCount",
     }
-    r = requests.post(PLACES_SEARCH_URL, headers=headers, json=payload, timeout=30)
+    r = _CLIENT.post(PLACES_SEARCH_URL, headers=headers, json=payload, timeout=30)
     r.raise_for_status()
-    return r.json().get("places", [])
+    return _parse_json(r).get("places", [])
 
+@functools.lru_cache(maxsize=1024)
 def place_details(api_key: str, place_id: str, region_code: Optional[str] = None):
-    field_mask = ",".join([
-        "id","displayName","formattedAddress","nationalPhoneNumber",
-        "websiteUri","googleMapsUri","priceLevel","rating","userRatingCount",
-        "currentOpeningHours","regularOpeningHours"
-    ])
+    # الكاش على مستوى العملية: Streamlit يعيد تشغيل السكربت مع كل تفاعل،
+    # فالتفاصيل لنفس الـ place_id تُجلب مرة واحدة فقط.
     url = PLACES_DETAILS_URL_TMPL.format(place_id=place_id)
-    headers = {"X-Goog-Api-Key": api_key,"X-Goog-FieldMask": field_mask}
+    headers = {"X-Goog-Api-Key": api_key,"X-Goog-FieldMask": DETAILS_FIELD_MASK}
     params = {"languageCode": "ar"}
     if region_code: params["regionCode"] = region_code
-    r = requests.get(url, headers=headers, params=params, timeout=30)
+    r = _CLIENT.get(url, headers=headers, params=params, timeout=30)
     r.raise_for_status()
-    return r.json()
+    return _parse_json(r)
 
 # -----------------------------
 # WordPress REST
@@ -167,23 +271,81 @@ def create_or_update_draft_post(base_url, user, app_password, title, content_htm
     endpoint = f"{base_url.rstrip('/')}/wp-json/wp/v2/posts"
     payload = {"title": title, "content": content_html, "status": "draft"}
     url = f"{endpoint}/{post_id}" if post_id else endpoint
-    r = requests.post(url, auth=auth, json=payload, timeout=60)
+    r = _CLIENT.post(url, auth=auth, json=payload, timeout=60)
     r.raise_for_status()
-    return r.json()
+    return _parse_json(r)
 
 # -----------------------------
 # Orchestration
 # -----------------------------
+async def _aplace_details(client, place_id: str, region_code: Optional[str] = None):
+    params = {"languageCode": "ar"}
+    if region_code: params["regionCode"] = region_code
+    r = await client.get(PLACES_DETAILS_URL_TMPL.format(place_id=place_id), params=params, timeout=30)
+    r.raise_for_status()
+    return _parse_json(r)
+
+async def _afetch_all(api_key: str, pids: List[str], region_code: Optional[str] = None):
+    headers = {"X-Goog-Api-Key": api_key, "X-Goog-FieldMask": DETAILS_FIELD_MASK}
+    limits = httpx.Limits(max_connections=50)
+    # HTTP/2 (إن توفر h2) يمرر كل الطلبات عبر اتصال TLS واحد
+    async with httpx.AsyncClient(http2=_HTTP2, headers=headers, limits=limits) as client:
+        return await asyncio.gather(
+            *[_aplace_details(client, pid, region_code=region_code) for pid in pids],
+            return_exceptions=True,
+        )
+
+# ذاكرة التفاصيل لمسار httpx، بنفس مفتاح lru_cache على place_details في
+# المسار المتزامن؛ بدونها كان الـ gather يعيد شراء كل التفاصيل مع كل rerun
+_DETAILS_MEMO: Dict[tuple, Dict] = {}
+_DETAILS_MEMO_MAX = 1024
+
+def _fetch_details_map(api_key: str, pids: List[str], region_code: Optional[str] = None) -> Dict[str, Dict]:
+    """يجلب تفاصيل كل الأماكن بالتوازي (I/O-bound) ويرجع dict: place_id -> details."""
+    if httpx is not None:
+        details = {}
+        missing = []
+        for pid in pids:
+            det = _DETAILS_MEMO.get((api_key, pid, region_code))
+            if det is not None:
+                details[pid] = det
+            else:
+                missing.append(pid)
+        if missing:
+            if len(_DETAILS_MEMO) > _DETAILS_MEMO_MAX:
+                _DETAILS_MEMO.clear()
+            results = asyncio.run(_afetch_all(api_key, missing, region_code=region_code))
+            for pid, det in zip(missing, results):
+                if not isinstance(det, BaseException):
+                    details[pid] = det
+                    _DETAILS_MEMO[(api_key, pid, region_code)] = det
+        return details
+
+    details: Dict[str, Dict] = {}
+    with ThreadPoolExecutor(max_workers=DETAILS_MAX_WORKERS) as ex:
+        futs = {ex.submit(place_details, api_key, pid, region_code=region_code): pid for pid in pids}
+        for f in as_completed(futs):
+            pid = futs[f]
+            try:
+                details[pid] = f.result()
+            except Exception:
+                continue  # نتجاهل العنصر الفاشل ونكمل الباقي
+    return details
+
 def make_items_from_places(api_key: str, places: List[Dict], min_reviews: int = 200, region_code: Optional[str] = None):
-    items: List[Dict] = []
-    for p in places:
-        pid = p.get("id") or p.get("placeId")
-        if not pid: continue
+    pids = [p.get("id") or p.get("placeId") for p in places]
+    # إزالة التكرار مع الحفاظ على الترتيب: البحث قد يعيد نفس المكان مرتين
+    pids = list(dict.fromkeys(pid for pid in pids if pid))
+    details_by_id = _fetch_details_map(api_key, pids, region_code=region_code)
 
-        det = place_details(api_key, pid, region_code=region_code)
+    items: List[Dict] = []
+    for pid in pids:
+        det = details_by_id.get(pid)
+        if det is None: continue
 
         price_level = coerce_price_level(det.get("priceLevel"))
-        rating = safe_float(det.get("rating"))
+        # قيم رقمية مضمونة من البداية حتى يبقى الفرز/الفلترة بلا فحوصات None
+        rating = safe_float(det.get("rating"), 0.0)
         rating_count = safe_int(det.get("userRatingCount"))
 
         ch = det.get("regularOpeningHours", {}) or det.get("currentOpeningHours", {}) or {}
@@ -191,6 +353,7 @@ def make_items_from_places(api_key: str, places: List[Dict], min_reviews: int =
         thursday_times = extract_thursday_times(weekday_desc)
 
         items.append({
+            "id": pid,
             "name": det.get("displayName", {}).get("text", ""),
             "address": det.get("formattedAddress", ""),
             "phone": det.get("nationalPhoneNumber", ""),
@@ -205,11 +368,14 @@ def make_items_from_places(api_key: str, places: List[Dict], min_reviews: int =
             "rating_count": rating_count,
         })
 
-    # فلترة وترتيب بقيم رقمية مؤكدة
+    if not items: return items
+
+    # فلترة وترتيب في تمريرة واحدة عبر pandas بدل حلقتين بايثونيتين
+    # الاستيراد مؤجل: pandas لا يلزم إلا هنا، فلا يدفع ثمنه الإقلاع البارد
+    import pandas as pd
+
     min_rev = safe_int(min_reviews)
-    items = [it for it in items if safe_int(it.get("rating_count")) >= min_rev]
-    items.sort(
-        key=lambda x: (safe_float(x.get("rating"), -1.0), safe_int(x.get("rating_count"), -1)),
-        reverse=True
-    )
-    return items
+    df = pd.DataFrame(items)
+    mask = df["rating_count"].to_numpy() >= min_rev
+    df = df.loc[mask].sort_values(["rating", "rating_count"], ascending=False, kind="mergesort")
+    return df.to_dict("records")